@@ -13,15 +13,14 @@ extended inserts (because import is slower). This scipt can solve the problem.
 Inspired by: http://blog.lavoie.sl/2014/06/split-mysqldump-extended-inserts.html
 
 Current version is functional enough to do the job in most cases, but is not
-optimized, so can use a lot of memory and take a lot of time to finish the job.
+optimized, so can take a lot of time to finish the job. File is processed in
+parts of limited size, so memory usage doesn't depend on file size nor on
+length of lines. Parts are processed in parallel, one process per
+available CPU (up to 32). Added line breaks are the same as the line break
+of the first line ('\n' or '\r\n').
 
 Possible enhancements:
 
-- in process_file():
--- readline (one line at a time) instead of readlines, to lower memory usage
--- write (append) processed line into file immediately and free the memory
--- force output file to be different than input file
-
 - in ask_confirmation():
 -- use list of allowed answers (e.g. "y", "yes", etc.), not only one option
 
@@ -33,7 +32,37 @@ Author: Marcin Lewicz
 License: MIT
 """
 
-import os.path
+import collections
+import concurrent.futures
+import contextlib
+import io
+import itertools
+import os
+
+# size of read/write buffers (bytes); default 8 KiB means too many syscalls
+# for multi-GB dumps
+BUFFER_SIZE = 4 * 1024 * 1024
+
+# max length (bytes) of line part processed at once; longer lines are split
+# into parts, so memory usage doesn't depend on line length
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# line parts are grouped into batches of about this size (bytes); batch is
+# processed by one worker process and written to output file at once
+BATCH_SIZE = 4 * 1024 * 1024
+
+# after this many batches in a row processed by workers with wrong initial
+# state, batches starting inside a line are not sent to workers
+MAX_WRONG_ASSUMPTIONS = 3
+
+# default number of worker processes is limited to this (on Windows
+# ProcessPoolExecutor doesn't accept more than 61)
+MAX_JOBS = 32
+
+# max size (bytes) of input of batches sent to workers and not written yet;
+# processed batches take about the same size, so this limits memory usage
+# regardless of number of workers
+MAX_PENDING_SIZE = 128 * 1024 * 1024
 
 def main():
         """
@@ -41,161 +70,402 @@ def main():
         """
 
         file_name = ask_input_file_name("Input file name: ")
-        output_file_name = ask_output_file_name("Output file name: ")
+        output_file_name = ask_output_file_name("Output file name: ", file_name)
         process_file(file_name, output_file_name)
 
 
-class State:
+def process_file(file_name, output_file_name, jobs=None):
         """
-        Used to store information about quotes and brackets from previous lines.
+        Reads file, adds '\n' before opening brackets and writes changed file.
+
+        Output file must be different than input file (input file is read
+        while output file is written).
+
+        File is processed in batches by jobs worker processes (by default one
+        per CPU available for this process, see default_jobs()). If jobs is 1,
+        file is processed in current process.
         """
 
-        # quote started in previous line(s)?
-        in_quotes = False
-        # number of brackets opened in previous line(s)
-        brackets = 0
+        if same_file(file_name, output_file_name):
+                raise ValueError("Output file must be different than input file: " + output_file_name)
+
+        line_number = 0
+        output_lines_count = 0
+        bytes_done = 0
+
+        print("Processing file: " + file_name + "...")
+
+        with open(file_name, "rb", buffering=BUFFER_SIZE) as f, \
+                        open(output_file_name, "wb", buffering=BUFFER_SIZE) as o:
 
+                if jobs is None:
+                        jobs = default_jobs()
 
-def process_file(file_name, output_file_name):
+                # added line breaks are the same as in the first line
+                head = f.peek(BUFFER_SIZE)
+                end = head.find(b"\n")
+                newline = b"\r\n" if end > 0 and head[end - 1:end] == b"\r" else b"\n"
+
+                if jobs == 1:
+                        results = process_batches(read_batches(f), newline)
+                else:
+                        results = process_batches_parallel(read_batches(f), jobs, newline)
+
+                file_size = os.fstat(f.fileno()).st_size
+
+                for output, size, lines, output_lines, messages in results:
+                        o.write(output)
+                        print(messages, end="")
+
+                        line_number += lines
+                        output_lines_count += output_lines
+
+                        # inform user that it's still alive (every 16 MiB)
+                        if (bytes_done + size) >> 24 != bytes_done >> 24:
+                                print("Processed {:.1%}...".format((bytes_done + size) / file_size))
+                        bytes_done += size
+
+        print("Done! Input lines: " + str(line_number) + ", output lines: " + str(output_lines_count))
+        print("Output file " + output_file_name + " ready.")
+
+
+def default_jobs():
         """
-        Reads file, adds '\n' before opening brackets and writes changed file.
+        Return number of CPUs this process can use (respecting CPU affinity
+        where it's available), but not more than MAX_JOBS.
         """
-        
-        lines = []
-        output_lines = []
-        temp_state = State()
-        temp_state.in_quotes = False
-        temp_state.brackets = 0
 
-        with open(file_name) as f:
-                lines = f.readlines()
+        if hasattr(os, "process_cpu_count"):
+                cpus = os.process_cpu_count()
+        elif hasattr(os, "sched_getaffinity"):
+                cpus = len(os.sched_getaffinity(0))
+        else:
+                cpus = os.cpu_count()
 
-        print("Processing file: " + file_name + "...")
+        return min(cpus or 1, MAX_JOBS)
 
-        lines_count = str(len(lines))
-        line_number = 0
 
-        for line in lines:
+def process_batches(batches, newline=b"\n"):
+        """
+        Process batches of line parts one by one. Yield the same results as
+        process_batches_parallel().
+        """
 
-                line_number += 1
+        state = (False, 0, False, False)
 
-                # inform user that it's still alive
-                if line_number % 10000 == 0:
-                        print("Processing line " + str(line_number) + "/" + lines_count)
-                        
-                # do not change empty lines (containing only '\n')
-                if len(line) == 1:
-                        output_lines.append(line)
-                        continue
+        for parts in batches:
+                output, state, lines, output_lines = process_parts(parts, state, newline)
+                yield output, sum(map(len, parts)), lines, output_lines, ""
 
-                # do not change commented lines
-                if line[:2] == "--":
-                        output_lines.append(line)
-                        continue
 
-                processed_line, temp_state = process_line(line, temp_state)
+def process_batches_parallel(batches, jobs, newline=b"\n"):
+        """
+        Process batches of line parts in jobs worker processes.
+
+        Yield tuples (processed bytes, input bytes, input lines, output lines,
+        messages) in order of batches.
+
+        State after previous batch is not known when batch is sent to worker,
+        so worker assumes that batch doesn't start in quotes nor in brackets
+        (true for batches starting with new statement or new row, see
+        read_batches()). If the assumption turns out to be wrong, batch is
+        processed again with correct state.
+
+        After MAX_WRONG_ASSUMPTIONS wrong assumptions in a row, batches
+        starting inside a line are processed in current process only. Batches
+        starting with a new line are still sent to workers (the assumption is
+        reliable there) and the first correct assumption resets the count.
+        """
+
+        state = (False, 0, False, False)
+        # batches in order: (parts, size, assumed state, future); batches not
+        # sent to workers have None instead of assumed state and future
+        pending = collections.deque()
+        pending_size = 0
+        continued = False
+        wrong_assumptions = 0
+
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+
+                # None marks the end of batches
+                for parts in itertools.chain(batches, [None]):
+
+                        if parts is not None:
+                                size = sum(map(len, parts))
+                                pending_size += size
+
+                                if not continued or wrong_assumptions < MAX_WRONG_ASSUMPTIONS:
+                                        assumed_state = (False, 0, continued, False)
+                                        future = executor.submit(process_batch, parts, assumed_state, newline)
+                                        pending.append((parts, size, assumed_state, future))
+                                else:
+                                        pending.append((parts, size, None, None))
 
-                for p in processed_line:
-                        output_lines.append(p)
+                                continued = parts[-1][-1:] != b"\n"
 
-        print("Done! Input lines: " + str(len(lines)) + ", output lines: " + str(len(output_lines)))
+                        # limit number of batches kept in memory
+                        while pending and (parts is None or len(pending) > 2 * jobs
+                                        or pending_size > MAX_PENDING_SIZE):
+                                batch_parts, size, assumed_state, future = pending.popleft()
+                                pending_size -= size
 
-        print("Saving file...")
-        with open(output_file_name , "w") as o:
-                for l in output_lines:
-                        o.write(l)
+                                if assumed_state == state:
+                                        output, state, lines, output_lines, messages = future.result()
+                                        wrong_assumptions = 0
+                                else:
+                                        if future is not None:
+                                                future.cancel()
+                                                wrong_assumptions += 1
+                                        output, state, lines, output_lines, messages = \
+                                                process_batch(batch_parts, state, newline)
 
-        print("Done. Output file " + output_file_name + " ready.")
+                                yield output, size, lines, output_lines, messages
 
 
-def process_line(line, previous_state):
+def process_batch(parts, state, newline=b"\n"):
         """
-        Read line, split it before opening brackets if not in quotes nor escaped
-        and add '\n' in the end of new lines.
+        Process line parts like process_parts(), but return printed messages
+        (e.g. warnings) instead of printing them, as the last item of result.
         """
 
-        # opening bracket and/or quote can start in other line
-        brackets = previous_state.brackets
-        in_quotes = previous_state.in_quotes
-        escaped = False
-        processed_line = []
-        start = 0
+        with contextlib.redirect_stdout(io.StringIO()) as messages:
+                result = process_parts(parts, state, newline)
+
+        return result + (messages.getvalue(),)
+
+
+def process_parts(parts, state, newline=b"\n"):
+        """
+        Process line parts (as yielded by read_parts()). Use newline as added
+        line breaks.
+
+        State describes previous parts: tuple (in_quotes, brackets, continued,
+        skipped), where continued is True if first part continues a line and
+        skipped is True if that line is passed without changes.
+
+        Return processed bytes, state after the last part, number of lines
+        started in parts and number of output lines started in parts.
+        """
+
+        in_quotes, brackets, continued, skipped = state
+        lines = 0
+        output_lines = 0
+        output = bytearray()
+
+        for part in parts:
+
+                if not continued:
+                        lines += 1
+                        output_lines += 1
 
-        for i in range(len(line)):
+                        # do not change empty lines (containing only '\n' or
+                        # '\r\n') and commented lines
+                        first = part[:1]
+                        skipped = first == b"\n" or (first == b"-" and part[1:2] == b"-") \
+                                or (first == b"\r" and part[1:2] == b"\n")
 
-                if line[i] == '\\':
-                        escaped = not escaped
-                        
-                elif line[i] == '\'':
-                        if escaped:
-                                escaped = False
+                if skipped:
+                        output += part
+                else:
+                        in_quotes, brackets, new_lines = process_line(part, in_quotes, brackets, output.extend, continued, newline)
+                        output_lines += new_lines
+
+                continued = part[-1:] != b"\n"
+
+        # skipped matters only if next part continues the line
+        return output, (in_quotes, brackets, continued, skipped and continued), lines, output_lines
+
+
+def read_batches(f):
+        """
+        Read line parts from file f (see read_parts()) and yield them in lists
+        of about BATCH_SIZE bytes.
+
+        Batch ends with a whole line if possible. If it ends inside a long
+        line, last part is cut between rows of extended insert ("),(") if it
+        contains one, so next batch (most likely) starts outside quotes and
+        brackets.
+        """
+
+        batch = []
+        size = 0
+
+        for part in read_parts(f):
+                batch.append(part)
+                size += len(part)
+
+                if size >= BATCH_SIZE:
+                        cut = part.rfind(b"),(") + 2 if part[-1:] != b"\n" else 0
+
+                        if cut > 1:
+                                batch[-1] = part[:cut]
+                                yield batch
+                                batch = [part[cut:]]
+                                size = len(part) - cut
                         else:
-                                in_quotes = not in_quotes
-
-                elif line[i] == '(':
-                        if not in_quotes:
-                                if brackets == 0:
-                                        # don't append additional empty line
-                                        if i > 0:
-                                                processed_line.append(line[start:i] + "\n")
-                                        start = i
-                                brackets += 1
-                        if escaped:
-                                escaped = False
-                                
-                elif line[i] == ')':
-                        if not in_quotes:
-                                if brackets > 0:
-                                        brackets -= 1
-                                else:
-                                        print("Warning: closing ')' without opening '('!")
-                                        print(line)
-                        if escaped:
-                                escaped = False
+                                yield batch
+                                batch = []
+                                size = 0
 
-                # line[i] other than mentioned above
-                elif escaped:
-                        escaped = False
+        if batch:
+                yield batch
 
-        # append remaining part
-        processed_line.append(line[start:])
 
-        current_state = State()
-        current_state.in_quotes = in_quotes
-        current_state.brackets = brackets
+def read_parts(f):
+        """
+        Read lines from file f. Yield lines longer than CHUNK_SIZE in parts.
+
+        Part of line never ends with '\\' (unless file does), so escaping
+        character and escaped character are always in the same part. Part has
+        at least 2 characters (unless line is shorter), so commented lines
+        can be recognized by the first part.
+        """
+
+        while True:
+                part = f.readline(CHUNK_SIZE)
+
+                while part[-1:] == b"\\" or (len(part) == 1 and part != b"\n"):
+                        rest = f.readline(CHUNK_SIZE)
+                        if not rest:
+                                break
+                        part += rest
+
+                if not part:
+                        return
+
+                yield part
+
+
+def process_line(line, in_quotes, brackets, write, continued=False, newline=b"\n"):
+        """
+        Read line, split it before opening brackets if not in quotes nor escaped
+        and add '\n' in the end of new lines. Pass processed line to write
+        function (in fragments).
+
+        in_quotes and brackets describe state after previous line (quote and
+        opening brackets can start in other line). Return the state after this
+        line and number of added '\n'.
+
+        If continued is True, line is a part of longer line, so split is made
+        also before opening bracket at the beginning of the part. newline is
+        used instead of '\n' (e.g. b"\r\n" for files with Windows line
+        endings).
+        """
+
+        new_lines = 0
+        start = 0
+        pos = 0
+        end = len(line)
+        find = line.find
+        # without '\' in line no quote is escaped, so escaping needn't be
+        # checked (the most common case)
+        escapes = b"\\" in line
+
+        # positions of next quote and brackets (found by str.find, in C)
+        quote = opening = closing = -1
+
+        while pos < end:
+
+                if in_quotes:
+                        # only quote can end quoted text, brackets don't matter
+                        quote = find(b"'", pos)
+                        if quote < 0:
+                                break
+                        pos = quote + 1
+
+                        if not escapes:
+                                in_quotes = False
+                                continue
+
+                        # quote is escaped if preceded by odd number of '\'
+                        i = quote
+                        while i > 0 and line[i - 1:i] == b"\\":
+                                i -= 1
+                        if (quote - i) % 2 == 0:
+                                in_quotes = False
+                        continue
+
+                # outside quotes: jump to the nearest quote or bracket
+                if quote < pos:
+                        quote = find(b"'", pos)
+                        if quote < 0:
+                                quote = end
+                if opening < pos:
+                        opening = find(b"(", pos)
+                        if opening < 0:
+                                opening = end
+                if closing < pos:
+                        closing = find(b")", pos)
+                        if closing < 0:
+                                closing = end
+
+                i = min(quote, opening, closing)
+                if i == end:
+                        break
+                pos = i + 1
+
+                if i == quote:
+                        if escapes:
+                                in_quotes = True
+                        else:
+                                # jump over quoted text at once
+                                quote = find(b"'", pos)
+                                if quote < 0:
+                                        in_quotes = True
+                                        break
+                                pos = quote + 1
+
+                elif i == opening:
+                        if brackets == 0:
+                                # don't append additional empty line
+                                if i > 0 or continued:
+                                        write(line[start:i] + newline)
+                                        new_lines += 1
+                                start = i
+                        brackets += 1
+
+                # i == closing
+                elif brackets > 0:
+                        brackets -= 1
+                else:
+                        print("Warning: closing ')' without opening '('!")
+                        print(line.decode(errors="replace"))
+
+        # append remaining part
+        write(line[start:])
 
-        return processed_line, current_state
+        return in_quotes, brackets, new_lines
 
-def ask_output_file_name(message):
-        """ Ask user for name of output file. """
+def ask_output_file_name(message, input_file_name):
+        """ Ask user for name of output file (other than input file). """
         
-        file_name = ask_value(message)
+        while True:
+                file_name = ask_value(message)
 
-        if verify_file_name(file_name):
-                return file_name
-        else:
-                return ask_output_file_name(message)
+                if same_file(input_file_name, file_name):
+                        print("Output file must be different than input file.")
+                        continue
+
+                if verify_file_name(file_name):
+                        return file_name
 
 def ask_input_file_name(message):
         """ Ask user for name of file to be processed. """
 
-        file_name = ask_value(message)
+        while True:
+                file_name = ask_value(message)
+
+                if file_exists(file_name):
+                        return file_name
 
-        if file_exists(file_name):
-                return file_name
-        else:
                 print("File not found.")
-                return ask_input_file_name(message)
 
 def verify_file_name(file_name):
         """ If file exists, confirm overwriting. """
         
         if file_exists(file_name):
-                if ask_confirmation("File exists! Do you want to overwrite file " + file_name + "? "):
-                        return True
-                else:
-                        return False
-                              
+                return ask_confirmation("File exists! Do you want to overwrite file " + file_name + "? ")
+
         # TODO: check if is correct and ready to write
         return True
         
@@ -203,10 +473,13 @@ def verify_file_name(file_name):
 def file_exists(file_name):
         """ Return True if file exists or False if not. """
 
-        if os.path.isfile(file_name):
-                return True
-        else:
-                return False
+        return os.path.isfile(file_name)
+
+
+def same_file(file_name, other_file_name):
+        """ Return True if both names point to the same existing file. """
+
+        return os.path.exists(other_file_name) and os.path.samefile(file_name, other_file_name)
 
 
 def ask_value(message):
@@ -219,12 +492,11 @@ def ask_value(message):
         Return (string): value typed by user
         """
         
-        answer = input(message)
-
-        if answer == '':
-                return ask_value(message)
+        while True:
+                answer = input(message)
 
-        return answer
+                if answer != '':
+                        return answer
 
 def ask_confirmation(message, yes = 'y', no = 'n', default = False):
         """
@@ -261,16 +533,18 @@ def ask_confirmation(message, yes = 'y', no = 'n', default = False):
                 no = no.upper()
                 
         long_message = message + " [" + yes + "/" + no + "]: "
-        answer = input(long_message).lower()
-
-        if answer == yes.lower():
-                return True
-        elif answer == no.lower():
-                return False
-        elif answer == '':
-                return default
-        else:
-                return ask_confirmation(message, yes, no, default)
+        yes = yes.lower()
+        no = no.lower()
+
+        while True:
+                answer = input(long_message).lower()
+
+                if answer == yes:
+                        return True
+                elif answer == no:
+                        return False
+                elif answer == '':
+                        return default
 
 if __name__ == "__main__":
         main()